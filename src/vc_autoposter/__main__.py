@@ -1,21 +1,24 @@
 """Entry point"""
 
+import argparse
+import itertools
 import logging
 import sched
 import sys
+import time
 
 from datetime import datetime
+from typing import Iterator
 
+from vc_autoposter.backfill import run_backfill
 from vc_autoposter.config import Config, load_config
+from vc_autoposter.logs import log_context, setup_logging
 from vc_autoposter.poster import Poster
+from vc_autoposter.status import board, serve
 
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler(sys.stderr)
-handler.setLevel(logging.INFO)
-fmter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-handler.setFormatter(fmter)
-logger.addHandler(handler)
+
+ticks: Iterator[int] = itertools.count(1)
 
 
 def schedule_post(scheduler: sched.scheduler, delay: int, poster: Poster):
@@ -40,14 +43,109 @@ def schedule_post(scheduler: sched.scheduler, delay: int, poster: Poster):
             poster,
         ),
     )
+    old_topic: int = poster.topic
     poster.update_from_config(config)
-    poster.post_new_vc()
+    if poster.topic != old_topic:
+        board.forget(old_topic)
+    board.deadline = config.tick_deadline * 60
+    board.scheduled(poster.topic, time.time() + new_delay)
+    tick: int = next(ticks)
+    board.tick_started(poster.topic, tick)
+    success: bool = False
+    with log_context(poster.topic, tick):
+        try:
+            success = poster.post_new_vc()
+        except Exception as e:
+            logger.exception("Unexpected error while posting VC", exc_info=e)
+    board.tick_finished(poster.topic, success, poster.last_vc_at)
+
+
+def positive_int(value: str) -> int:
+    """Argument type for integers greater than 0"""
+    number: int = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+    return number
+
+
+def positive_float(value: str) -> float:
+    """Argument type for numbers greater than 0"""
+    number: float = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+    return number
+
 
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parses command line arguments"""
+    parser = argparse.ArgumentParser(prog="vc-auto-poster")
+    commands = parser.add_subparsers(dest="command")
 
-def main():
+    backfill = commands.add_parser(
+        "backfill",
+        help="Write the votecount at past posts to a JSONL file.",
+        description=(
+            "Write a snapshot of the votecount every N posts to a JSONL file, "
+            "skipping snapshots where no votes changed. Running it again with "
+            "the same file resumes after the last snapshot."
+        ),
+    )
+    backfill.add_argument("output", help="JSONL file to append snapshots to.")
+    backfill.add_argument(
+        "--topic", type=positive_int, help="Topic ID. Defaults to the configured topic."
+    )
+    backfill.add_argument(
+        "--start", type=positive_int, default=1, help="First post number."
+    )
+    backfill.add_argument(
+        "--end",
+        type=positive_int,
+        help="Last post number. Defaults to the latest post.",
+    )
+    backfill.add_argument(
+        "--every",
+        type=positive_int,
+        default=1,
+        help="Posts between snapshots. 1 catches every vote change.",
+    )
+    backfill.add_argument(
+        "--workers", type=positive_int, default=4, help="Number of concurrent requests."
+    )
+    backfill.add_argument(
+        "--rate", type=positive_float, default=2.0, help="Maximum requests per second."
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
     """main"""
-    logger.info("VC Auto-poster starting...")
+    args = parse_args(argv)
     config: Config = load_config()
+    listener = setup_logging(config.log_json, config.log_rate_limit * 60)
+    try:
+        if args.command == "backfill":
+            if args.topic is not None:
+                config.topic = args.topic
+            return run_backfill(
+                config,
+                args.output,
+                start=args.start,
+                end=args.end,
+                every=args.every,
+                workers=args.workers,
+                rate=args.rate,
+            )
+
+        run(config)
+        return 0
+    finally:
+        listener.stop()
+
+
+def run(config: Config):
+    """Runs the scheduler until interrupted"""
+    logger.info("VC Auto-poster starting...")
     poster: Poster = Poster.from_config(config)
     logger.info("VC Auto-poster initialized!")
     logger.info(
@@ -72,8 +170,20 @@ def main():
         )
         initial_delay = initial_delay * 60
 
+    board.deadline = config.tick_deadline * 60
+    stop_watchdog = None
+    if config.status_port is not None:
+        stop_watchdog = serve(config.status_host, config.status_port, board)
+
     scheduler.enter(initial_delay, 1, schedule_post, (scheduler, delay, poster))
-    scheduler.run()
+    board.scheduled(config.topic, time.time() + initial_delay)
+    board.set_running(True)
+    try:
+        scheduler.run()
+    finally:
+        board.set_running(False)
+        if stop_watchdog is not None:
+            stop_watchdog.set()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,338 @@
+"""Builds historical votecount timelines"""
+
+import json
+import logging
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import PosixPath
+from typing import Any, Final, Iterator, TextIO
+
+import httpx
+
+from pydiscourse.exceptions import DiscourseError  # type: ignore
+
+from vc_autoposter.config import Config
+from vc_autoposter.poster import RETRY_ATTEMPTS
+from vc_autoposter.sites import Site, registry
+from vc_autoposter.votecount import VotecountClient, Votecount, Voter
+
+logger = logging.getLogger()
+
+RATE_LIMIT_WAIT: Final[float] = 10.0
+WINDOW_PER_WORKER: Final[int] = 4
+
+
+class RateLimiter:
+    """Spaces requests evenly across every thread sharing it."""
+
+    def __init__(self, per_second: float):
+        self.interval: float = 1 / per_second
+        self._next: float = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def wait(self) -> bool:
+        """Blocks until the next request may be made.
+
+        Returns `False` if the limiter was stopped while waiting.
+        """
+        with self._lock:
+            now: float = time.monotonic()
+            at: float = max(now, self._next)
+            self._next = at + self.interval
+        return not self._stopped.wait(at - now)
+
+    def stop(self):
+        """Wakes every waiting thread, and makes later waits fail."""
+        self._stopped.set()
+
+    def back_off(self, seconds: float):
+        """Holds every thread off for `seconds`."""
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+def fetch_voters(
+    client: VotecountClient, limiter: RateLimiter, post: int
+) -> list[Voter] | None:
+    """Fetches voters at a post, retrying on rate limits and request errors."""
+    for i in range(RETRY_ATTEMPTS):
+        if i != 0:
+            logger.info("Retrying post %s...", post)
+
+        if not limiter.wait():
+            return None
+        try:
+            data = client.get_data_from_post(post)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 429:
+                logger.error("Votecount at post %s returned %s.", post, e.response)
+                return None
+            retry_after: str = e.response.headers.get("Retry-After", "")
+            wait: float = (
+                float(retry_after) if retry_after.isdigit() else RATE_LIMIT_WAIT
+            )
+            logger.info("Rate limited at post %s. Waiting %s seconds.", post, wait)
+            limiter.back_off(wait)
+            continue
+        except httpx.RequestError as e:
+            logger.warning("Encountered an HTTP request error at post %s: %s", post, e)
+            limiter.back_off(RATE_LIMIT_WAIT)
+            continue
+        except ValueError as e:
+            logger.error("Votecount at post %s is not valid JSON: %s", post, e)
+            return None
+
+        return client._process_data(data)
+
+    return None
+
+
+def vc_to_record(vc: Votecount, topic: int, post: int) -> dict[str, Any]:
+    """Converts a votecount into a JSON-serializable snapshot."""
+    return {
+        "topic": topic,
+        "post": post,
+        "voted": {k: [v.name for v in voters] for k, voters in vc.voted.items()},
+        "not_voting": [v.name for v in vc.not_voting],
+        "unknown": [{"name": v.name, "vote": v.vote} for v in vc.unknown],
+        "voters": [
+            {"name": v.name, "vote": v.vote, "post": v.post}
+            for v in vc.all_voters.values()
+        ],
+    }
+
+
+def vc_from_record(record: dict[str, Any], topic: int) -> Votecount:
+    """Rebuilds enough of a votecount from a snapshot to resume from it."""
+    vc: Votecount = Votecount()
+    for v in record["voters"]:
+        vc.all_voters[v["name"]] = Voter(
+            name=v["name"],
+            vote=v["vote"],
+            post=v["post"],
+            topic_of_post=topic if v["post"] is not None else None,
+        )
+    return vc
+
+
+def votes_key(vc: Votecount) -> tuple[tuple[str, str], ...]:
+    """Key that only changes when someone's vote does."""
+    return tuple(sorted((v.name, v.vote) for v in vc.all_voters.values()))
+
+
+def is_record(data: Any) -> bool:
+    """Checks that parsed JSON looks like a snapshot from `vc_to_record`."""
+    match data:
+        case {"topic": int(), "post": int(), "voters": list(voters)}:
+            return all(
+                isinstance(v, dict) and {"name", "vote", "post"} <= v.keys()
+                for v in voters
+            )
+        case _:
+            return False
+
+
+def read_last_record(path: PosixPath) -> dict[str, Any] | None:
+    """Returns the last complete snapshot in `path`.
+
+    Raises `ValueError` without touching the file if any complete line isn't a
+    snapshot, so pointing this at the wrong file can't damage it. A final line
+    with no newline, left by an interrupted write after at least one snapshot,
+    is truncated away.
+    """
+    if not path.exists():
+        return None
+
+    last: dict[str, Any] | None = None
+    good_until: int = 0
+    partial: bool = False
+    with open(path, "rb") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.endswith(b"\n"):
+                partial = True
+                break
+            try:
+                data: Any = json.loads(line)
+            except ValueError:
+                data = None
+            if not is_record(data):
+                raise ValueError(f"line {number} is not a backfill snapshot")
+            last = data
+            good_until = f.tell()
+
+    if partial:
+        if last is None:
+            raise ValueError("it is not a backfill file")
+        logger.warning("Truncating partial snapshot at the end of %s.", path)
+        with open(path, "rb+") as f:
+            f.truncate(good_until)
+
+    return last
+
+
+def backfill(
+    client: VotecountClient,
+    posts: Iterator[int],
+    out: TextIO,
+    workers: int,
+    limiter: RateLimiter,
+) -> int | None:
+    """Writes a snapshot for every post where the votes changed.
+
+    Posts are fetched by a fixed pool of workers, but only a small window ahead
+    of the writer, so memory use doesn't depend on how many posts there are.
+    Returns the number of snapshots written, or `None` if it had to stop early.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            return _write_snapshots(client, posts, out, workers, limiter, pool)
+        finally:
+            # On an error or Ctrl-C, don't wait for fetches that would be wasted
+            limiter.stop()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _write_snapshots(
+    client: VotecountClient,
+    posts: Iterator[int],
+    out: TextIO,
+    workers: int,
+    limiter: RateLimiter,
+    pool: ThreadPoolExecutor,
+) -> int | None:
+    """Does the work of `backfill` with a running pool."""
+    last_key = votes_key(client.last_vc) if client.last_vc is not None else None
+    written: int = 0
+    pending: deque[tuple[int, Future[list[Voter] | None]]] = deque()
+
+    while True:
+        while len(pending) < workers * WINDOW_PER_WORKER:
+            next_post: int | None = next(posts, None)
+            if next_post is None:
+                break
+            pending.append(
+                (next_post, pool.submit(fetch_voters, client, limiter, next_post))
+            )
+
+        if len(pending) == 0:
+            return written
+
+        post, future = pending.popleft()
+        voters: list[Voter] | None = future.result()
+        if voters is None:
+            logger.error(
+                "Could not get votecount at post %s. Stopping, run again to resume.",
+                post,
+            )
+            for _, f in pending:
+                f.cancel()
+            return None
+
+        vc: Votecount = client.vc_from_voters(voters)
+        key = votes_key(vc)
+        if key == last_key:
+            continue
+
+        last_key = key
+        record: dict[str, Any] = vc_to_record(vc, client.topic, post)
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        written += 1
+
+
+def run_backfill(
+    config: Config,
+    path: str,
+    start: int,
+    end: int | None,
+    every: int,
+    workers: int,
+    rate: float,
+) -> int:
+    """Backfills a topic's votecount timeline into a JSONL file."""
+    path_: PosixPath = PosixPath(path).expanduser().resolve()
+    site: Site = registry.acquire(config.url, config.api_username, config.api_key)
+    try:
+        return _run_backfill(config, site, path_, start, end, every, workers, rate)
+    finally:
+        registry.release(site)
+
+
+def _run_backfill(
+    config: Config,
+    site: Site,
+    path_: PosixPath,
+    start: int,
+    end: int | None,
+    every: int,
+    workers: int,
+    rate: float,
+) -> int:
+    """Backfills into `path_` using an acquired site."""
+    if end is None:
+        try:
+            topic: dict[str, Any] = site.discourse_client._get(
+                f"/t/{config.topic}.json"
+            )
+        except DiscourseError as e:
+            logger.exception("Encountered a Discourse error", exc_info=e)
+            return 1
+        end = topic.get("highest_post_number")
+        if end is None:
+            logger.error("Could not find latest post number.")
+            return 1
+
+    client: VotecountClient = VotecountClient(
+        url=config.url,
+        topic=config.topic,
+        keep_unknown_votes=config.keep_unknown_votes,
+        unique_voter_substring_match=config.unique_voter_substring_match,
+        min_voter_substring_length=config.min_voter_substring_length,
+        http_client=site.http,
+    )
+
+    last: dict[str, Any] | None
+    try:
+        last = read_last_record(path_)
+    except (OSError, ValueError) as e:
+        logger.error("Can't resume from %s: %s. Use another file.", path_, e)
+        return 1
+    if last is not None:
+        if last.get("topic") != config.topic:
+            logger.error(
+                "%s has snapshots for topic #%s, not #%s. Use another file.",
+                path_,
+                last.get("topic"),
+                config.topic,
+            )
+            return 1
+        client.last_vc = vc_from_record(last, config.topic)
+        start = max(start, last["post"] + every)
+        logger.info("Resuming from post %s.", start)
+
+    logger.info(
+        "Backfilling topic #%s from post %s to %s every %s posts into %s.",
+        config.topic,
+        start,
+        end,
+        every,
+        path_,
+    )
+    with open(path_, "a", encoding="utf-8") as out:
+        written: int | None = backfill(
+            client,
+            iter(range(start, end + 1, every)),
+            out,
+            workers,
+            RateLimiter(rate),
+        )
+
+    if written is None:
+        return 1
+
+    logger.info("Backfill finished. Wrote %s new snapshots.", written)
+    return 0
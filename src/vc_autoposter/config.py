@@ -28,11 +28,19 @@ class Config:
     pretty: bool = False
     links: bool = False
     game_name: str | None = None
+    max_post_length: int = 32000
 
     keep_unknown_votes: bool = False
     unique_voter_substring_match: bool = False
     min_voter_substring_length: int = 3
 
+    log_json: bool = False
+    log_rate_limit: int = 60
+
+    status_port: int | None = None
+    status_host: str = "127.0.0.1"
+    tick_deadline: int = 5
+
 
 def load_config(path: str | PosixPath | None = None) -> Config:
     """Loads the configuration"""
@@ -0,0 +1,185 @@
+"""Non-blocking log output"""
+
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Final, Iterator
+
+QUEUE_SIZE: Final[int] = 10_000
+TEXT_FORMAT: Final[str] = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_topic: ContextVar[int | None] = ContextVar("topic", default=None)
+_tick: ContextVar[int | None] = ContextVar("tick", default=None)
+
+
+@contextmanager
+def log_context(topic: int | None, tick: int | None) -> Iterator[None]:
+    """Tags every record logged inside the block with a topic and tick."""
+    topic_token = _topic.set(topic)
+    tick_token = _tick.set(tick)
+    try:
+        yield
+    finally:
+        _tick.reset(tick_token)
+        _topic.reset(topic_token)
+
+
+class ContextFilter(logging.Filter):
+    """Adds `topic` and `tick` fields from the current `log_context`."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "topic"):
+            record.topic = _topic.get()
+        if not hasattr(record, "tick"):
+            record.tick = _tick.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Drops repeats of a message type within an interval.
+
+    Only applies to records logged with `extra={"rate_limit": True}`. The
+    message type is the unformatted message plus the topic, so the same notice
+    for different topics is limited separately. The first record let through
+    after a quiet period carries a `suppressed` count of what was dropped.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval: float = interval
+        self._seen: dict[tuple[str, Any, int | None], tuple[float, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "rate_limit", False):
+            return True
+
+        key = (record.name, record.msg, getattr(record, "topic", None))
+        now: float = time.monotonic()
+        seen: tuple[float, int] | None = self._seen.get(key)
+        if seen is not None and now - seen[0] < self.interval:
+            self._seen[key] = (seen[0], seen[1] + 1)
+            return False
+
+        record.suppressed = 0 if seen is None else seen[1]
+        self._seen[key] = (now, 0)
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """Plain text formatter that notes suppressed repeats."""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        message: str = super().formatMessage(record)
+        suppressed: int = getattr(record, "suppressed", 0)
+        if suppressed:
+            message = f"{message} ({suppressed} similar messages suppressed)"
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "topic": getattr(record, "topic", None),
+            "tick": getattr(record, "tick", None),
+        }
+        suppressed: int = getattr(record, "suppressed", 0)
+        if suppressed:
+            data["suppressed"] = suppressed
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks the caller.
+
+    Records are dropped and counted when the queue is full, and a warning with
+    the count is queued ahead of the next record once there's room. Formatting,
+    including tracebacks, is left to the listener thread.
+    """
+
+    def __init__(self, queue_: queue.Queue[Any]):
+        super().__init__(queue_)
+        self.dropped: int = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if self.dropped > 0:
+                self.queue.put_nowait(self.dropped_record(record))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def dropped_record(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Warning that records were dropped, tagged like `record`."""
+        dropped = logging.LogRecord(
+            name=__name__,
+            level=logging.WARNING,
+            pathname=__file__,
+            lineno=0,
+            msg=f"{self.dropped} log records dropped because the queue was full.",
+            args=None,
+            exc_info=None,
+        )
+        dropped.message = dropped.msg
+        dropped.topic = getattr(record, "topic", None)
+        dropped.tick = getattr(record, "tick", None)
+        return dropped
+
+
+def setup_logging(
+    json_output: bool, rate_limit_interval: float
+) -> logging.handlers.QueueListener:
+    """Routes root logger output through a queue to a background writer.
+
+    The returned listener is already running, and must be stopped on exit to
+    flush whatever is still queued.
+    """
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setLevel(logging.INFO)
+    if json_output:
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(TextFormatter(TEXT_FORMAT))
+
+    queue_: queue.Queue[Any] = queue.Queue(QUEUE_SIZE)
+    handler = DroppingQueueHandler(queue_)
+    handler.setLevel(logging.INFO)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(RateLimitFilter(rate_limit_interval))
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    for old in logger.handlers[:]:
+        logger.removeHandler(old)
+    logger.addHandler(handler)
+
+    listener = logging.handlers.QueueListener(
+        queue_, stream_handler, respect_handler_level=True
+    )
+    listener.start()
+    return listener
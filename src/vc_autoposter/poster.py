@@ -1,11 +1,12 @@
 """Makes new Discourse posts"""
 
 import logging
+import sys
 
+from dataclasses import dataclass
 from types import SimpleNamespace
 from typing import Any, Final, Self
 
-from pydiscourse import DiscourseClient  # type: ignore
 from pydiscourse.exceptions import (  # type: ignore
     DiscourseError,
     DiscourseServerError,
@@ -14,11 +15,54 @@ from pydiscourse.exceptions import (  # type: ignore
 )
 
 from vc_autoposter.config import Config
-from vc_autoposter.votecount import VotecountClient, Votecount
+from vc_autoposter.sites import Site, SiteDiscourseClient, registry
+from vc_autoposter.votecount import VotecountClient, Votecount, Voter
 
 logger = logging.getLogger()
 
 RETRY_ATTEMPTS: Final[int] = 3
+TABLE_HEADER: Final[tuple[str, str]] = ("| Votes | Wagon | Voters |", "|---|---|---|")
+CONTINUED: Final[str] = "[size=2](continued)[/size]\n"
+
+# Lines of a post, and whether they're a table row. Table rows don't include
+# the header, which is added in front of the first row in each post.
+Section = tuple[list[str], bool]
+
+
+class PostTooLong(Exception):
+    """Rendered post is longer than the site allows."""
+
+
+@dataclass(slots=True)
+class Budget:
+    """Tracks the length of a post while it's rendered."""
+
+    limit: int = sys.maxsize
+    used: int = -1
+
+    def take(self, line: str) -> str:
+        """Counts a line (and its newline), raising if over the limit."""
+        self.used += len(line) + 1
+        if self.used > self.limit:
+            raise PostTooLong(self.used, self.limit)
+        return line
+
+
+def post_length(lines: list[str]) -> int:
+    """Length of lines once they're joined into a post."""
+    return len("\n".join(lines))
+
+
+def section_lines(sections: list[Section]) -> list[str]:
+    """Joins sections into the lines of a single post."""
+    lines: list[str] = []
+    in_table: bool = False
+    for section, is_row in sections:
+        if is_row and not in_table:
+            lines += TABLE_HEADER
+        lines += section
+        in_table = is_row
+    return lines
 
 
 class Poster:
@@ -38,6 +82,7 @@ class Poster:
         keep_unknown_votes: bool,
         unique_voter_substring_match: bool,
         min_voter_substring_length: int,
+        max_post_length: int,
     ):
         self.url: str = url
         self.topic: int = topic
@@ -48,16 +93,17 @@ class Poster:
         self.links: bool = links
         self.game_name: str | None = game_name
         self.suppress_tags: set[str] = set(suppress_tags)
+        self.max_post_length: int = max_post_length
 
-        self.discourse_client: DiscourseClient = DiscourseClient(
-            url, api_username=api_username, api_key=api_key
-        )
+        self.site: Site = registry.acquire(url, api_username, api_key)
+        self.discourse_client: SiteDiscourseClient = self.site.discourse_client
         self.vc_client: VotecountClient = VotecountClient(
             url=url,
             topic=topic,
             keep_unknown_votes=keep_unknown_votes,
             unique_voter_substring_match=unique_voter_substring_match,
             min_voter_substring_length=min_voter_substring_length,
+            http_client=self.site.http,
         )
         self.last_vc_at: int = 0
 
@@ -77,6 +123,7 @@ class Poster:
             keep_unknown_votes=config.keep_unknown_votes,
             unique_voter_substring_match=config.unique_voter_substring_match,
             min_voter_substring_length=config.min_voter_substring_length,
+            max_post_length=config.max_post_length,
         )
 
     def update_from_config(self, config: Config):
@@ -87,29 +134,21 @@ class Poster:
             or config.api_username != self.api_username
             or config.api_key != self.api_key
         ):
-            self.discourse_client = DiscourseClient(
-                config.url, api_username=config.api_username, api_key=config.api_key
+            old_site: Site = self.site
+            self.site = registry.acquire(
+                config.url, config.api_username, config.api_key
             )
-
-        if (
-            config.url != self.url
-            or config.topic != self.topic
-            or self.vc_client.unique_voter_substring_match
-            or self.vc_client.keep_unknown_votes
-            != config.keep_unknown_votes
-            != config.unique_voter_substring_match
-            or self.vc_client.min_voter_substring_length
-            != config.min_voter_substring_length
-        ):
-            last_vc = self.vc_client.last_vc
-            self.vc_client = VotecountClient(
-                url=config.url,
-                topic=config.topic,
-                keep_unknown_votes=config.keep_unknown_votes,
-                unique_voter_substring_match=config.unique_voter_substring_match,
-                min_voter_substring_length=config.min_voter_substring_length,
-            )
-            self.vc_client.last_vc = last_vc
+            registry.release(old_site)
+            self.discourse_client = self.site.discourse_client
+
+        self.vc_client.url = config.url
+        self.vc_client.topic = config.topic
+        self.vc_client.keep_unknown_votes = config.keep_unknown_votes
+        self.vc_client.unique_voter_substring_match = (
+            config.unique_voter_substring_match
+        )
+        self.vc_client.min_voter_substring_length = config.min_voter_substring_length
+        self.vc_client.http_client = self.site.http
 
         if config.topic != self.topic:
             logger.info("Topic ID changed from #%s to #%s.", self.topic, config.topic)
@@ -124,13 +163,31 @@ class Poster:
         self.links = config.links
         self.game_name = config.game_name
         self.suppress_tags = set(config.suppress_tags)
+        self.max_post_length = config.max_post_length
 
     def get_topic_by_id(self) -> dict[str, Any]:
         """Gets topic by ID"""
         return self.discourse_client._get(f"/t/{self.topic}.json")  # type: ignore
 
-    def vc_to_lines(self, vc: Votecount, links: bool) -> list[str]:
+    def format_name(self, voter: Voter, links: bool, short_links: bool) -> str:
+        """Formats a voter's name, as a link if `links` is set.
+
+        Short links are relative and not bold, which saves a lot of characters
+        in big games.
+        """
+        if not links:
+            return voter.name
+        if short_links:
+            return voter.name_as_link("", self.topic, bold=False)
+        return voter.name_as_link(self.url, self.topic, bold=True)
+
+    def vc_to_lines(
+        self, vc: Votecount, links: bool, budget: Budget | None = None
+    ) -> list[str]:
         """Returns self as formatted lines."""
+        if budget is None:
+            budget = Budget()
+
         voted_names: dict[str, list[str]]
         not_voting_names: list[str]
 
@@ -160,73 +217,250 @@ class Poster:
         lines: list[str] = []
         for key in sorted(voted_names, key=lambda k: len(voted_names[k]), reverse=True):
             lines.append(
-                f"**{key} ({len(voted_names[key])}):** {', '.join(voted_names[key])}"
+                budget.take(
+                    f"**{key} ({len(voted_names[key])}):** {', '.join(voted_names[key])}"
+                )
             )
 
-        lines.append("")
+        lines.append(budget.take(""))
         lines.append(
-            f"**Not Voting ({len(not_voting_names)}):** {', '.join(not_voting_names)}"
+            budget.take(
+                f"**Not Voting ({len(not_voting_names)}):** {', '.join(not_voting_names)}"
+            )
         )
         return lines
 
-    def vc_to_table(self, vc: Votecount, links: bool) -> list[str]:
-        """Generates a Markdown table from a Votecount"""
-
-        header: str = "| Votes | Wagon | Voters |"
-        divider: str = "|---|---|---|"
-        lines: list[str] = [header, divider]
-
-        voted_names: dict[str, list[str]]
-        not_voting_names: list[str]
-        unknown_names: list[str]
+    def table_not_voting(self, vc: Votecount) -> list[Voter]:
+        """Voters listed as not voting in the table."""
+        if self.vc_client.keep_unknown_votes:
+            return vc.not_voting
+        return vc.not_voting + vc.unknown
 
-        if links:
-            voted_names = {
-                k: [n.name_as_link(self.url, self.topic, bold=True) for n in v]
-                for k, v in vc.voted.items()
-            }
-            not_voting_names = [
-                n.name_as_link(self.url, self.topic, bold=True) for n in vc.not_voting
+    def vc_to_table(
+        self,
+        vc: Votecount,
+        links: bool,
+        short_links: bool = False,
+        collapse_not_voting: bool = False,
+        budget: Budget | None = None,
+    ) -> list[str]:
+        """Generates a Markdown table from a Votecount
+
+        If `collapse_not_voting` is set, the not voting row only has a count,
+        and the names are left for `not_voting_details`.
+        """
+        if budget is None:
+            budget = Budget()
+
+        lines: list[str] = [budget.take(line) for line in TABLE_HEADER]
+
+        voted_names: dict[str, list[str]] = {
+            k: [self.format_name(n, links, short_links) for n in v]
+            for k, v in vc.voted.items()
+        }
+        not_voting: list[Voter] = self.table_not_voting(vc)
+        unknown_names: list[str] = []
+        if self.vc_client.keep_unknown_votes:
+            unknown_names = [
+                f"{self.format_name(n, links, short_links)} (for {n.vote})"
+                for n in vc.unknown
             ]
-            if self.vc_client.keep_unknown_votes:
-                unknown_names = [
-                    f"{n.name_as_link(self.url, self.topic, bold=True)} (for {n.vote})"
-                    for n in vc.unknown
-                ]
-            else:
-                not_voting_names += [
-                    n.name_as_link(self.url, self.topic, bold=True) for n in vc.unknown
-                ]
-        else:
-            voted_names = {k: [n.name for n in v] for k, v in vc.voted.items()}
-            not_voting_names = [n.name for n in vc.not_voting]
-            if self.vc_client.keep_unknown_votes:
-                unknown_names = [f"{n.name} (for {n.vote})" for n in vc.not_voting]
-            else:
-                not_voting_names += [n.name for n in vc.unknown]
 
         for target in sorted(
             voted_names, key=lambda k: len(voted_names[k]), reverse=True
         ):
             lines.append(
-                f"| {len(voted_names[target])} | **{target}** | {', '.join(voted_names[target])} |"
+                budget.take(
+                    f"| {len(voted_names[target])} | **{target}** | {', '.join(voted_names[target])} |"
+                )
             )
 
+        not_voting_cell: str = "See below"
+        if not collapse_not_voting:
+            not_voting_cell = ", ".join(
+                self.format_name(n, links, short_links) for n in not_voting
+            )
         lines.append(
-            f"| {len(not_voting_names)} | **Not Voting** | {', '.join(not_voting_names)}"
+            budget.take(f"| {len(not_voting)} | **Not Voting** | {not_voting_cell}")
         )
 
         if len(unknown_names) > 0:
             lines.append(
-                f"| {len(unknown_names)} | **Unrecognized** | {', '.join(unknown_names)}"
+                budget.take(
+                    f"| {len(unknown_names)} | **Unrecognized** | {', '.join(unknown_names)}"
+                )
             )
 
         return lines
 
+    def not_voting_details(
+        self, vc: Votecount, budget: Budget | None = None
+    ) -> list[str]:
+        """Lists not voting names, without links, in a collapsed block."""
+        if budget is None:
+            budget = Budget()
+
+        not_voting: list[Voter] = self.table_not_voting(vc)
+        return [
+            budget.take(""),
+            budget.take(f'[details="Not Voting ({len(not_voting)})"]'),
+            budget.take(", ".join(n.name for n in not_voting)),
+            budget.take("[/details]"),
+        ]
+
+    def render_sections(
+        self,
+        vc: Votecount,
+        day: int | None,
+        short_links: bool = False,
+        collapse_not_voting: bool = False,
+        budget: Budget | None = None,
+    ) -> list[Section]:
+        """Renders a VC post as sections.
+
+        Sections are never split across posts. Table rows are sections of their
+        own, marked so the table header can go in front of them in each post.
+        """
+        if budget is None:
+            budget = Budget()
+
+        sections: list[Section] = []
+
+        if self.pretty:
+            title: str = "Votecount"
+            if day is not None:
+                title = f"Day {day} {title}"
+            if self.game_name is not None:
+                title = f"{self.game_name} {title}"
+            sections.append(
+                (
+                    [
+                        budget.take("[center]"),
+                        budget.take(f"# [size=5][color=#9370db]{title}[/color][/size]"),
+                        budget.take("[/center]"),
+                    ],
+                    False,
+                )
+            )
+
+            table: list[str] = self.vc_to_table(
+                vc,
+                links=self.links,
+                short_links=short_links,
+                collapse_not_voting=collapse_not_voting,
+                budget=budget,
+            )
+            sections += [([row], True) for row in table[len(TABLE_HEADER) :]]
+
+            if collapse_not_voting:
+                sections.append((self.not_voting_details(vc, budget), False))
+
+        raw: list[str] = []
+        if self.pretty:
+            raw.append(budget.take(""))
+            raw.append(budget.take('[details="Raw VC for the plugin"]'))
+
+        raw.append(budget.take("[votecount]"))
+        raw += self.vc_to_lines(vc, links=False, budget=budget)
+        raw.append(budget.take("[/votecount]"))
+
+        if self.pretty:
+            raw.append(budget.take("[/details]"))
+        sections.append((raw, False))
+
+        sections.append(
+            (
+                [
+                    budget.take(
+                        "\n[size=2]I'm a new bot, and I made this post. "
+                        "Please forgive any mistakes 😖.[/size]"
+                    ),
+                    budget.take("[size=2]If you're mean to me I WILL cry.[/size]"),
+                ],
+                False,
+            )
+        )
+        return sections
+
+    def split_sections(self, sections: list[Section]) -> list[str] | None:
+        """Packs sections into as few posts as will fit.
+
+        Returns `None` if a single section is too long for a post by itself.
+        """
+        posts: list[str] = []
+        current: list[str] = []
+        in_table: bool = False
+
+        for section, is_row in sections:
+            lines: list[str] = section
+            if is_row and not in_table:
+                lines = list(TABLE_HEADER) + section
+
+            if len(current) > 0 and post_length(current + lines) > self.max_post_length:
+                posts.append("\n".join(current))
+                current = [CONTINUED]
+                if is_row:
+                    lines = list(TABLE_HEADER) + section
+
+            if post_length(current + lines) > self.max_post_length:
+                return None
+
+            current += lines
+            in_table = is_row
+
+        posts.append("\n".join(current))
+        return posts
+
+    def render_posts(self, vc: Votecount, day: int | None) -> list[str] | None:
+        """Renders a VC as one post, or several if it's too long for one.
+
+        Each more compact style is tried in turn, and rendering stops as soon as
+        it goes over `max_post_length`. If even the most compact style is too
+        long, it's split into continuation posts. Returns `None` if it can't be
+        made to fit.
+        """
+        styles: list[tuple[bool, bool]] = [(False, False)]
+        if self.pretty:
+            if self.links:
+                styles.append((True, False))
+            styles.append((True, True))
+
+        for short_links, collapse_not_voting in styles:
+            try:
+                sections: list[Section] = self.render_sections(
+                    vc,
+                    day,
+                    short_links=short_links,
+                    collapse_not_voting=collapse_not_voting,
+                    budget=Budget(self.max_post_length),
+                )
+            except PostTooLong:
+                logger.info(
+                    "VC is over %s characters (short links: %s, collapsed: %s).",
+                    self.max_post_length,
+                    short_links,
+                    collapse_not_voting,
+                )
+                continue
+            return ["\n".join(section_lines(sections))]
+
+        short_links, collapse_not_voting = styles[-1]
+        posts: list[str] | None = self.split_sections(
+            self.render_sections(
+                vc,
+                day,
+                short_links=short_links,
+                collapse_not_voting=collapse_not_voting,
+            )
+        )
+        if posts is not None:
+            logger.info("Splitting VC into %s posts.", len(posts))
+        return posts
+
     def is_suppressed(self, last_post_num: int, tags: list[str], closed: bool) -> bool:
         """Checks if output should be suppressed."""
         if closed:
-            logger.info("Topic is closed. Skipping.")
+            logger.info("Topic is closed. Skipping.", extra={"rate_limit": True})
             return True
 
         if last_post_num - self.last_vc_at < self.min_posts:
@@ -239,6 +473,7 @@ class Poster:
                 last_post_num,
                 last_post_num - self.last_vc_at,
                 self.last_vc_at + self.min_posts,
+                extra={"rate_limit": True},
             )
             return True
 
@@ -247,13 +482,14 @@ class Poster:
             logger.info(
                 "Output suppressed due to 1 or more tags (%s). Skipping.",
                 ", ".join(suppress_tags),
+                extra={"rate_limit": True},
             )
             return True
 
         return False
 
-    def post_new_vc(self):
-        """Posts a new VC."""
+    def post_new_vc(self) -> bool:
+        """Posts a new VC. Returns `False` if something went wrong."""
         logger.info("Attempting to post new votecount for topic ID #%s.", self.topic)
 
         try:
@@ -265,12 +501,12 @@ class Poster:
             DiscourseClientError,
         ) as e:
             logger.exception("Encountered a Discourse error", exc_info=e)
-            return
+            return False
 
         last_post_num: int | None = getattr(topic, "highest_post_number", None)
         if last_post_num is None:
             logger.error("Could not find latest post number.")
-            return
+            return False
 
         tags: list[str] = getattr(topic, "tags", [])
 
@@ -280,7 +516,7 @@ class Poster:
             closed = True
 
         if self.is_suppressed(last_post_num, tags, closed):
-            return
+            return True
 
         day: int | None = None
 
@@ -298,49 +534,41 @@ class Poster:
                 last_post_num,
                 self.topic,
             )
-            return
+            return False
 
-        lines: list[str] = []
-
-        if self.pretty:
-            lines.append("[center]")
-            title: str = "Votecount"
-            if day is not None:
-                title = f"Day {day} {title}"
-            if self.game_name is not None:
-                title = f"{self.game_name} {title}"
-            lines.append(f"# [size=5][color=#9370db]{title}[/color][/size]")
-            lines.append("[/center]")
-
-            lines = lines + self.vc_to_table(vc, links=self.links)
-
-            lines.append("")
-            lines.append('[details="Raw VC for the plugin"]')
-
-        lines.append("[votecount]")
-        lines = lines + self.vc_to_lines(vc, links=False)
-        lines.append("[/votecount]")
+        posts: list[str] | None = self.render_posts(vc, day)
+        if posts is None:
+            logger.error(
+                "VC for topic #%s can't fit in posts of %s characters. Skipping.",
+                self.topic,
+                self.max_post_length,
+            )
+            return False
 
-        if self.pretty:
-            lines.append("[/details]")
+        logger.info("Attempting to post VC to topic #%s...", self.topic)
+        for post in posts:
+            last_vc_at: int | None = self.create_post(post)
+            if last_vc_at is None:
+                return False
 
-        lines.append(
-            (
-                "\n[size=2]I'm a new bot, and I made this post. "
-                "Please forgive any mistakes 😖.[/size]"
+            logger.info(
+                "VC posted successfully to topic #%s at post #%s!",
+                self.topic,
+                last_vc_at,
             )
-        )
-        lines.append("[size=2]If you're mean to me I WILL cry.[/size]")
+            self.last_vc_at = last_vc_at
 
-        logger.info("Attempting to post VC to topic #%s...", self.topic)
-        last_vc_at: int | None = None
+        return True
+
+    def create_post(self, raw: str) -> int | None:
+        """Creates a post in the topic, and returns its post number."""
         for i in range(RETRY_ATTEMPTS):
             if i != 0:
                 logger.info("Retrying post...")
 
             try:
                 response = self.discourse_client.create_post(
-                    "\n".join(lines),
+                    raw,
                     topic_id=self.topic,
                 )
             except (
@@ -350,18 +578,13 @@ class Poster:
                 DiscourseClientError,
             ) as e:
                 logger.exception("Encountered a Discourse error", exc_info=e)
-                return
+                return None
             response_ns = SimpleNamespace(**response)
-            last_vc_at = getattr(response_ns, "post_number", None)
-            if last_vc_at is not None:
-                logger.info(
-                    "VC posted successfully to topic #%s at post #%s!",
-                    self.topic,
-                    last_vc_at,
-                )
-                self.last_vc_at = last_vc_at
-                return
+            post_number: int | None = getattr(response_ns, "post_number", None)
+            if post_number is not None:
+                return post_number
 
         logger.warning(
             "VC could not be posted after %s attempts. Skipping.", RETRY_ATTEMPTS
         )
+        return None
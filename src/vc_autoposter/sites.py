@@ -0,0 +1,398 @@
+"""Shares connections between every topic on the same Discourse site"""
+
+import logging
+import socket
+import threading
+import time
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Final, Iterable, Iterator
+
+import httpcore
+import httpx
+
+from pydiscourse import DiscourseClient  # type: ignore
+from pydiscourse.exceptions import (  # type: ignore
+    DiscourseError,
+    DiscourseServerError,
+    DiscourseRateLimitedError,
+    DiscourseClientError,
+)
+
+logger = logging.getLogger(__name__)
+
+DNS_TTL: Final[float] = 300.0
+TIMEOUT: Final[float] = 30.0
+MAX_CONNECTIONS: Final[int] = 10
+RATE_LIMIT_RETRIES: Final[int] = 4
+JSON_CONTENT: Final[str] = "application/json; charset=utf-8"
+
+
+class DnsCache:
+    """Caches resolved addresses for a fixed TTL."""
+
+    def __init__(self, ttl: float):
+        self.ttl: float = ttl
+        self._entries: dict[tuple[str, int], tuple[float, list[str]]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int) -> list[str]:
+        """Returns the addresses for a host, looking them up if expired."""
+        now: float = time.monotonic()
+        with self._lock:
+            entry: tuple[float, list[str]] | None = self._entries.get((host, port))
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses: list[str] = list(dict.fromkeys(str(i[4][0]) for i in infos))
+        with self._lock:
+            self._entries[(host, port)] = (now + self.ttl, addresses)
+        return addresses
+
+    def forget(self, host: str, port: int):
+        """Drops a cached host, so it's looked up again next time."""
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+class CachingBackend(httpcore.SyncBackend):
+    """Network backend that resolves hosts through a `DnsCache`.
+
+    Only the TCP connection uses the address. TLS still verifies the hostname.
+    """
+
+    def __init__(self, dns: DnsCache):
+        self.dns: DnsCache = dns
+
+    def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: float | None = None,
+        local_address: str | None = None,
+        socket_options: Iterable[Any] | None = None,
+    ) -> httpcore.NetworkStream:
+        try:
+            addresses: list[str] = self.dns.resolve(host, port)
+        except socket.gaierror as e:
+            raise httpcore.ConnectError(e) from e
+
+        error: Exception | None = None
+        for address in addresses:
+            try:
+                return super().connect_tcp(
+                    address, port, timeout, local_address, socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+
+        self.dns.forget(host, port)
+        raise error or httpcore.ConnectError(f"No addresses for {host}")
+
+
+@dataclass(slots=True)
+class SiteStats:
+    """Connection statistics for a site"""
+
+    open_connections: int
+    in_flight: int
+    requests: int
+    errors: int
+    avg_latency: float | None
+    max_latency: float | None
+
+
+# httpcore errors and the httpx errors they're raised as
+ERRORS: Final[dict[type[Exception], type[httpx.TransportError]]] = {
+    httpcore.TimeoutException: httpx.TimeoutException,
+    httpcore.ConnectTimeout: httpx.ConnectTimeout,
+    httpcore.ReadTimeout: httpx.ReadTimeout,
+    httpcore.WriteTimeout: httpx.WriteTimeout,
+    httpcore.PoolTimeout: httpx.PoolTimeout,
+    httpcore.NetworkError: httpx.NetworkError,
+    httpcore.ConnectError: httpx.ConnectError,
+    httpcore.ReadError: httpx.ReadError,
+    httpcore.WriteError: httpx.WriteError,
+    httpcore.ProxyError: httpx.ProxyError,
+    httpcore.UnsupportedProtocol: httpx.UnsupportedProtocol,
+    httpcore.ProtocolError: httpx.ProtocolError,
+    httpcore.LocalProtocolError: httpx.LocalProtocolError,
+    httpcore.RemoteProtocolError: httpx.RemoteProtocolError,
+}
+
+
+@contextmanager
+def httpx_errors() -> Iterator[None]:
+    """Raises httpcore errors as the matching httpx error."""
+    try:
+        yield
+    except tuple(ERRORS) as e:
+        error = next(ERRORS[c] for c in type(e).__mro__ if c in ERRORS)
+        raise error(str(e)) from e
+
+
+class ResponseStream(httpx.SyncByteStream):
+    """Body of an httpcore response, for an `httpx.Response`"""
+
+    def __init__(self, stream: Iterable[bytes]):
+        self.stream: Iterable[bytes] = stream
+
+    def __iter__(self) -> Iterator[bytes]:
+        with httpx_errors():
+            yield from self.stream
+
+    def close(self):
+        if hasattr(self.stream, "close"):
+            self.stream.close()
+
+
+class SiteTransport(httpx.BaseTransport):
+    """HTTP transport with cached DNS that keeps request statistics.
+
+    httpx has no option for a network backend, so this owns its own httpcore
+    pool rather than relying on the internals of `httpx.HTTPTransport`.
+    """
+
+    def __init__(self, dns: DnsCache):
+        self.pool = httpcore.ConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=MAX_CONNECTIONS,
+            network_backend=CachingBackend(dns),
+        )
+        self._lock = threading.Lock()
+        self.in_flight: int = 0
+        self.requests: int = 0
+        self.errors: int = 0
+        self.total_latency: float = 0.0
+        self.max_latency: float = 0.0
+
+    def send(self, request: httpx.Request) -> httpx.Response:
+        """Sends a request through the pool."""
+        assert isinstance(request.stream, httpx.SyncByteStream)
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(
+                scheme=request.url.raw_scheme,
+                host=request.url.raw_host,
+                port=request.url.port,
+                target=request.url.raw_path,
+            ),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        )
+        with httpx_errors():
+            response: httpcore.Response = self.pool.handle_request(core_request)
+        assert isinstance(response.stream, Iterable)
+        return httpx.Response(
+            status_code=response.status,
+            headers=response.headers,
+            stream=ResponseStream(response.stream),
+            extensions=response.extensions,
+        )
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self.in_flight += 1
+        start: float = time.monotonic()
+        failed: bool = True
+        try:
+            response: httpx.Response = self.send(request)
+            failed = False
+            return response
+        finally:
+            latency: float = time.monotonic() - start
+            with self._lock:
+                self.in_flight -= 1
+                self.requests += 1
+                self.errors += failed
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    def stats(self) -> SiteStats:
+        """Returns current statistics. Latency is time to response headers."""
+        connections = self.pool.connections
+        with self._lock:
+            return SiteStats(
+                open_connections=sum(not c.is_closed() for c in connections),
+                in_flight=self.in_flight,
+                requests=self.requests,
+                errors=self.errors,
+                avg_latency=(
+                    self.total_latency / self.requests if self.requests else None
+                ),
+                max_latency=self.max_latency if self.requests else None,
+            )
+
+    def close(self):
+        self.pool.close()
+
+
+class SiteDiscourseClient(DiscourseClient):
+    """`DiscourseClient` that makes requests through a shared `httpx.Client`.
+
+    Raises the same errors as `DiscourseClient`, and also raises
+    `DiscourseError` for connection errors.
+    """
+
+    def __init__(self, host: str, api_username: str, api_key: str, http: httpx.Client):
+        super().__init__(host, api_username=api_username, api_key=api_key)
+        self.http: httpx.Client = http
+
+    def _request(
+        self,
+        verb: str,
+        path: str,
+        params: dict[str, Any] | None = None,
+        files: Any = None,
+        data: dict[str, Any] | None = None,
+        json: Any = None,
+        override_request_kwargs: dict[str, Any] | None = None,
+    ) -> Any:
+        headers: dict[str, str] = {
+            "Accept": JSON_CONTENT,
+            "Api-Key": self.api_key,
+            "Api-Username": self.api_username,
+        }
+        # Like requests, don't send fields that are None
+        if params is not None:
+            params = {k: v for k, v in params.items() if v is not None}
+        if data is not None:
+            data = {k: v for k, v in data.items() if v is not None}
+
+        for _ in range(RATE_LIMIT_RETRIES):
+            try:
+                response: httpx.Response = self.http.request(
+                    verb,
+                    self.host + path,
+                    params=params,
+                    files=files,
+                    data=data,
+                    json=json,
+                    headers=headers,
+                    **(override_request_kwargs or {}),
+                )
+            except httpx.RequestError as e:
+                raise DiscourseError(f"Request failed: {e}") from e
+
+            if response.status_code != 429:
+                break
+
+            wait: float = 10
+            if "application/json" in response.headers.get("Content-Type", ""):
+                wait = response.json().get("extras", {}).get("wait_seconds", wait)
+            logger.info("Rate limited by %s. Waiting %s seconds.", self.host, wait + 1)
+            time.sleep(wait + 1)
+        else:
+            raise DiscourseRateLimitedError(
+                "Number of rate limit retries exceeded.", response=response
+            )
+
+        if not response.is_success and not response.is_redirect:
+            try:
+                msg: str = ",".join(response.json()["errors"])
+            except (ValueError, TypeError, KeyError):
+                msg = f"{response.status_code}: {response.reason_phrase}"
+            if response.is_client_error:
+                raise DiscourseClientError(msg, response=response)
+            raise DiscourseServerError(msg, response=response)
+
+        if response.is_redirect:
+            raise DiscourseError(
+                "Unexpected Redirect, invalid api key or host?", response=response
+            )
+
+        content_type: str = response.headers.get("Content-Type", "")
+        if content_type != JSON_CONTENT:
+            if not response.content.strip():
+                return None
+            raise DiscourseError(
+                f'Invalid Response, expecting "{JSON_CONTENT}" got "{content_type}"',
+                response=response,
+            )
+
+        try:
+            decoded: Any = response.json()
+        except ValueError as e:
+            raise DiscourseError("failed to decode response", response=response) from e
+
+        if "errors" in decoded and len(decoded["errors"]) > 0:
+            raise DiscourseError(
+                decoded.get("message") or ",".join(decoded["errors"]),
+                response=response,
+            )
+
+        return decoded
+
+
+class Site:
+    """Clients for one Discourse site and set of credentials"""
+
+    def __init__(self, url: str, api_username: str, api_key: str, dns: DnsCache):
+        self.url: str = url
+        self.key: tuple[str, str, str] = (url, api_username, api_key)
+        self.users: int = 0
+        self.transport: SiteTransport = SiteTransport(dns)
+        self.http: httpx.Client = httpx.Client(
+            transport=self.transport, timeout=TIMEOUT
+        )
+        self.discourse_client: SiteDiscourseClient = SiteDiscourseClient(
+            url, api_username=api_username, api_key=api_key, http=self.http
+        )
+
+    def close(self):
+        """Closes every connection."""
+        self.http.close()
+
+
+class SiteRegistry:
+    """Hands out one `Site` per base URL and credentials.
+
+    Every topic on a site shares its connection pool and DNS cache, so the
+    number of connections grows with sites rather than topics. Sites are
+    counted as they're acquired and released, and closed once nothing uses
+    them.
+    """
+
+    def __init__(self, dns_ttl: float = DNS_TTL):
+        self.dns: DnsCache = DnsCache(dns_ttl)
+        self._sites: dict[tuple[str, str, str], Site] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url: str, api_username: str, api_key: str) -> Site:
+        """Returns the site for these settings, creating it if needed.
+
+        Every call must be matched by a call to `release`.
+        """
+        url = url.rstrip("/")
+        key = (url, api_username, api_key)
+        with self._lock:
+            site: Site | None = self._sites.get(key)
+            if site is None:
+                logger.info("Opening connections to %s as %s.", url, api_username)
+                site = Site(url, api_username, api_key, self.dns)
+                self._sites[key] = site
+            site.users += 1
+            return site
+
+    def release(self, site: Site):
+        """Releases a site, closing it if nothing else is using it."""
+        with self._lock:
+            site.users -= 1
+            if site.users > 0:
+                return
+            self._sites.pop(site.key, None)
+
+        logger.info("Closing connections to %s as %s.", site.url, site.key[1])
+        site.close()
+
+    def stats(self) -> dict[str, SiteStats]:
+        """Returns statistics for each site, keyed by URL and username."""
+        with self._lock:
+            sites = list(self._sites.items())
+        return {f"{key[1]}@{key[0]}": site.transport.stats() for key, site in sites}
+
+
+registry: Final[SiteRegistry] = SiteRegistry()
@@ -0,0 +1,221 @@
+"""Health, readiness and schedule status server"""
+
+import json
+import logging
+import threading
+import time
+
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Final
+
+from vc_autoposter.sites import registry
+
+logger = logging.getLogger()
+
+WATCHDOG_INTERVAL: Final[float] = 5.0
+
+
+def timestamp(when: float | None) -> str | None:
+    """Formats a `time.time()` value as ISO 8601."""
+    if when is None:
+        return None
+    return datetime.fromtimestamp(when, timezone.utc).isoformat()
+
+
+@dataclass(slots=True)
+class TopicStatus:
+    """Schedule status of one topic"""
+
+    topic: int
+    last_tick: int | None = None
+    last_success: str | None = None
+    last_success_tick: int | None = None
+    last_vc_at: int | None = None
+    next_run: str | None = None
+    consecutive_failures: int = 0
+    tick_started: str | None = None
+    stuck: bool = False
+
+
+class StatusBoard:
+    """Status of every topic, shared between the scheduler and the server.
+
+    The JSON served is only rebuilt after something changes, so polling it
+    costs about the same no matter how many topics there are.
+    """
+
+    def __init__(self, deadline: float = 300.0):
+        self.deadline: float = deadline
+        self.running: bool = False
+        self._topics: dict[int, TopicStatus] = {}
+        self._started: dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._cache: bytes | None = None
+
+    def _topic(self, topic: int) -> TopicStatus:
+        if topic not in self._topics:
+            self._topics[topic] = TopicStatus(topic)
+        return self._topics[topic]
+
+    def set_running(self, running: bool):
+        """Records whether the scheduler is running."""
+        with self._lock:
+            self.running = running
+
+    def scheduled(self, topic: int, when: float):
+        """Records the next time a topic will run."""
+        with self._lock:
+            self._topic(topic).next_run = timestamp(when)
+            self._cache = None
+
+    def forget(self, topic: int):
+        """Drops a topic that's no longer posted to."""
+        with self._lock:
+            self._topics.pop(topic, None)
+            self._started.pop(topic, None)
+            self._cache = None
+
+    def tick_started(self, topic: int, tick: int):
+        """Records the start of a tick."""
+        with self._lock:
+            status: TopicStatus = self._topic(topic)
+            status.last_tick = tick
+            status.tick_started = timestamp(time.time())
+            self._started[topic] = time.monotonic()
+            self._cache = None
+
+    def tick_finished(self, topic: int, success: bool, last_vc_at: int):
+        """Records the end of a tick."""
+        with self._lock:
+            status: TopicStatus = self._topic(topic)
+            if success:
+                status.last_success = timestamp(time.time())
+                status.last_success_tick = status.last_tick
+                status.consecutive_failures = 0
+            else:
+                status.consecutive_failures += 1
+            status.last_vc_at = last_vc_at or None
+            status.tick_started = None
+            status.stuck = False
+            self._started.pop(topic, None)
+            self._cache = None
+
+    def check_deadlines(self) -> list[int]:
+        """Flags ticks running past the deadline, and returns newly stuck topics."""
+        now: float = time.monotonic()
+        stuck: list[int] = []
+        with self._lock:
+            for topic, started in self._started.items():
+                status: TopicStatus = self._topics[topic]
+                if not status.stuck and now - started > self.deadline:
+                    status.stuck = True
+                    stuck.append(topic)
+            if len(stuck) > 0:
+                self._cache = None
+        return stuck
+
+    def live(self) -> bool:
+        """Scheduler is running and no tick is past its deadline."""
+        with self._lock:
+            return self.running and not any(s.stuck for s in self._topics.values())
+
+    def ready(self) -> bool:
+        """Scheduler is running and every topic has a run scheduled."""
+        with self._lock:
+            return self.running and all(
+                s.next_run is not None for s in self._topics.values()
+            )
+
+    def topics_json(self) -> bytes:
+        """Returns every topic's status as a JSON array."""
+        with self._lock:
+            if self._cache is None:
+                self._cache = json.dumps(
+                    [asdict(s) for s in self._topics.values()]
+                ).encode()
+            return self._cache
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """Serves `/livez`, `/readyz` and `/status`."""
+
+    server: "StatusServer"
+
+    def do_GET(self):
+        board: StatusBoard = self.server.board
+        match self.path.split("?")[0]:
+            case "/livez":
+                self.respond(board.live(), b"")
+            case "/readyz":
+                self.respond(board.ready(), b"")
+            case "/status":
+                sites: dict[str, Any] = {
+                    k: asdict(v) for k, v in registry.stats().items()
+                }
+                body: bytes = b"".join(
+                    (
+                        b'{"sites": ',
+                        json.dumps(sites).encode(),
+                        b', "topics": ',
+                        board.topics_json(),
+                        b"}",
+                    )
+                )
+                self.respond(board.live(), body)
+            case _:
+                self.send_error(404)
+
+    def respond(self, ok: bool, body: bytes):
+        """Sends a JSON response, with 503 if not `ok`."""
+        if body == b"":
+            body = json.dumps({"ok": ok}).encode()
+        self.send_response(200 if ok else 503)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any):
+        """Polling would flood the log, so requests aren't logged."""
+
+
+class StatusServer(ThreadingHTTPServer):
+    """HTTP server for a `StatusBoard`"""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], board: StatusBoard):
+        super().__init__(address, StatusHandler)
+        self.board: StatusBoard = board
+
+
+def watchdog(board: StatusBoard, stop: threading.Event):
+    """Logs ticks running past the deadline until `stop` is set."""
+    while not stop.wait(WATCHDOG_INTERVAL):
+        for topic in board.check_deadlines():
+            logger.warning(
+                "Tick for topic #%s has been running for over %s seconds.",
+                topic,
+                int(board.deadline),
+            )
+
+
+def serve(host: str, port: int, board: StatusBoard) -> threading.Event:
+    """Starts the status server and watchdog on background threads.
+
+    Set the returned event to stop the watchdog.
+    """
+    server = StatusServer((host, port), board)
+    threading.Thread(target=server.serve_forever, name="status", daemon=True).start()
+
+    stop = threading.Event()
+    threading.Thread(
+        target=watchdog, args=(board, stop), name="watchdog", daemon=True
+    ).start()
+    logger.info("Status server listening on %s:%s.", host, server.server_port)
+    return stop
+
+
+board: Final[StatusBoard] = StatusBoard()
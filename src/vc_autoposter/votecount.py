@@ -167,11 +167,13 @@ class VotecountClient:
     unique_voter_substring_match: bool
     min_voter_substring_length: int
     last_vc: Votecount | None = None
+    http_client: httpx.Client | None = None
 
     def get_data_from_post(self, post: int) -> Any:
         """Gets votecount data from post number."""
 
-        response: httpx.Response = httpx.get(
+        get = httpx.get if self.http_client is None else self.http_client.get
+        response: httpx.Response = get(
             f"{self.url}/votecount/{self.topic}/{post}.json",
             follow_redirects=True,
         )
@@ -214,6 +216,15 @@ class VotecountClient:
         if voters is None:
             return None
 
+        return self.vc_from_voters(voters)
+
+    def vc_from_voters(self, voters: list[Voter]) -> Votecount:
+        """Generates new votecount from parsed voters.
+
+        Must be called in post order, since posts missing from votes are filled
+        in from the last VC.
+        """
+
         vc: Votecount = Votecount()
         vc.all_voters = {v.name: v for v in voters}
 
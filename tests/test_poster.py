@@ -0,0 +1,69 @@
+"""Tests for splitting VCs that are too long for one post"""
+
+import pytest
+
+from vc_autoposter.config import Config
+from vc_autoposter.poster import TABLE_HEADER, Poster
+from vc_autoposter.votecount import NO_VOTE, Votecount, Voter
+
+
+def make_poster(max_post_length: int) -> Poster:
+    """Poster with links on, so the table is long"""
+    return Poster.from_config(
+        Config(
+            url="https://forum.example.com",
+            topic=123,
+            api_username="user",
+            api_key="key",
+            pretty=True,
+            links=True,
+            game_name="Test",
+            max_post_length=max_post_length,
+        )
+    )
+
+
+def make_vc(players: int) -> Votecount:
+    """VC where a third of the players aren't voting"""
+    vc = Votecount()
+    for i in range(players):
+        vote: str = NO_VOTE if i % 3 == 0 else f"player{i % 5}"
+        voter = Voter(f"player{i}", vote, 1000 + i, 123)
+        vc.all_voters[voter.name] = voter
+        if vote == NO_VOTE:
+            vc.not_voting.append(voter)
+        else:
+            vc.voted.setdefault(vote, []).append(voter)
+    return vc
+
+
+@pytest.mark.parametrize("max_post_length", [700, 900, 1500, 2200, 32000])
+def test_posts_have_one_header_and_fit(max_post_length: int):
+    posts = make_poster(max_post_length).render_posts(make_vc(40), day=3)
+
+    assert posts is not None
+    for post in posts:
+        assert len(post) <= max_post_length
+
+        lines: list[str] = post.split("\n")
+        rows: list[str] = [
+            line for line in lines if line.startswith("| ") and line not in TABLE_HEADER
+        ]
+        assert lines.count(TABLE_HEADER[0]) == (1 if rows else 0)
+        assert lines.count(TABLE_HEADER[1]) == (1 if rows else 0)
+        if rows:
+            header: int = lines.index(TABLE_HEADER[0])
+            assert lines[header + 1] == TABLE_HEADER[1]
+            assert lines[header + 2] == rows[0]
+
+
+def test_splits_only_when_needed():
+    poster = make_poster(900)
+    assert len(poster.render_posts(make_vc(40), day=3) or []) > 1
+
+    poster.max_post_length = 32000
+    assert len(poster.render_posts(make_vc(40), day=3) or []) == 1
+
+
+def test_too_long_for_any_post():
+    assert make_poster(300).render_posts(make_vc(40), day=3) is None